@@ -4,6 +4,8 @@
 
 """Charm for the ddeb-retriever, debug deb collector."""
 
+import hashlib
+import json
 import logging
 import os
 from enum import StrEnum
@@ -18,6 +20,15 @@ import ddeb_retriever
 logger = logging.getLogger(__name__)
 
 
+def _init_proxies():
+    """Export the model proxy settings for the workload and its tools."""
+    for var in ("HTTPS_PROXY", "HTTP_PROXY", "NO_PROXY"):
+        os.environ[var] = os.getenv(f"JUJU_CHARM_{var}", "")
+
+
+_init_proxies()
+
+
 class ConfigKey(StrEnum):
     """Keys for configuring the charm."""
 
@@ -30,16 +41,17 @@ class ConfigKey(StrEnum):
 class DdebCharm(ops.CharmBase):
     """Charm the service."""
 
+    _stored = ops.StoredState()
+
     def __init__(self, framework: ops.Framework):
         super().__init__(framework)
-        os.environ["HTTPS_PROXY"] = os.getenv("JUJU_CHARM_HTTPS_PROXY", "")
-        os.environ["HTTP_PROXY"] = os.getenv("JUJU_CHARM_HTTP_PROXY", "")
-        os.environ["NO_PROXY"] = os.getenv("JUJU_CHARM_NO_PROXY", "")
+        self._stored.set_default(applied_state="")
         framework.observe(self.on.install, self.apply)
         framework.observe(self.on.config_changed, self.apply)
         framework.observe(self.on.start, self.apply)
         framework.observe(self.on.secret_changed, self.apply)
         framework.observe(self.on.secret_rotate, self.apply)
+        framework.observe(self.on.upgrade_charm, self.reapply)
 
         framework.observe(self.on.update_action, self.action_update)
         framework.observe(self.on.run_action, self.action_run)
@@ -50,32 +62,57 @@ class DdebCharm(ops.CharmBase):
 
     def apply(self, *_):
         """Apply the full state of the application."""
-        if not self.config_is_valid():
+        cfg = dict(self.config)
+        lp_sign_config = self.validate_config(cfg)
+        if lp_sign_config is None:
+            # Force a full apply, which clears the blocked status, once the config is fixed.
+            self._stored.applied_state = ""
             return
 
-        ddeb_retriever.do_deps()
+        state = self.desired_state_hash(cfg, lp_sign_config)
+        if state == self._stored.applied_state:
+            logger.debug("Desired state already applied.")
+            return
+
+        deps_installed = ddeb_retriever.do_deps()
         ddeb_retriever.do_git(
-            remote=cast(str, self.config[ConfigKey.GIT_REMOTE]),
-            ref=cast(str, self.config[ConfigKey.GIT_REF]),
+            remote=cast(str, cfg[ConfigKey.GIT_REMOTE]),
+            ref=cast(str, cfg[ConfigKey.GIT_REF]),
         )
         ddeb_retriever.do_user()
-        ddeb_retriever.do_conf(self.lp_sign_config)
+        ddeb_retriever.do_conf(lp_sign_config)
         ddeb_retriever.do_dirs()
-        ddeb_retriever.do_systemd(cast(str, self.config[ConfigKey.SCHEDULE]))
+        ddeb_retriever.do_systemd(cast(str, cfg[ConfigKey.SCHEDULE]))
         ddeb_retriever.do_httpd()
         self.unit.set_ports(80)
         self.update_status()
+        # Retry on the next hook rather than recording a partial deployment.
+        if deps_installed:
+            self._stored.applied_state = state
+
+    def reapply(self, *_):
+        """Apply the full state, even if it matches the last applied one."""
+        self._stored.applied_state = ""
+        self.apply()
+
+    @staticmethod
+    def desired_state_hash(cfg: dict[str, bool | int | float | str], lp_sign_config: str) -> str:
+        """Return a digest of everything `apply` depends on."""
+        required: set[ConfigKey] = set(ConfigKey)  # type: ignore
+        state = {
+            "config": {key: value for key, value in cfg.items() if key in required},
+            "lp-sign-config": lp_sign_config,
+            "proxies": [os.environ[var] for var in ("HTTPS_PROXY", "HTTP_PROXY", "NO_PROXY")],
+        }
+        return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
 
-    @property
-    def lp_sign_config(self) -> str:
-        """Getter for the lp-sign-config secret.
+    def read_lp_sign_config(self, cfg: dict[str, bool | int | float | str]) -> str:
+        """Read the lp-sign-config secret referenced by a configuration snapshot.
 
         Returns the secret or a RuntimeError with a relevant status message.
         """
         try:
-            secret = self.model.get_secret(
-                id=str(self.model.config[ConfigKey.LP_SIGN_CONFIG])
-            ).get_content()
+            secret = self.model.get_secret(id=str(cfg[ConfigKey.LP_SIGN_CONFIG])).get_content()
         except ops.SecretNotFoundError as e:
             raise RuntimeError("The configured `lp-sign-config` is not a valid secret URI") from e
 
@@ -84,20 +121,21 @@ class DdebCharm(ops.CharmBase):
         except KeyError as e:
             raise RuntimeError("lp-sign-config secret is missing the `config` key") from e
 
-    def config_is_valid(self) -> bool:
-        """Validate configuration."""
+    def validate_config(self, cfg: dict[str, bool | int | float | str]) -> str | None:
+        """Validate a snapshot of the configuration.
+
+        Returns the lp-sign-config secret, or None after setting a blocked status.
+        """
         required: set[ConfigKey] = set(ConfigKey)  # type: ignore
-        if missing := required.difference(self.config.keys()):
+        if missing := required.difference(cfg.keys()):
             self.unit.status = BlockedStatus(f"Needs: {', '.join(missing)}")
-            return False
+            return None
 
         try:
-            self.lp_sign_config
+            return self.read_lp_sign_config(cfg)
         except RuntimeError as e:
             self.unit.status = BlockedStatus(str(e))
-            return False
-
-        return True
+            return None
 
     def action_update(self, event: ops.ActionEvent):
         """Update the retriever git tree."""
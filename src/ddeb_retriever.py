@@ -6,14 +6,19 @@
 The intention is that this module could be used outside the context of a charm.
 """
 
+import contextlib
+import errno
+import functools
 import json
 import logging
 import os
 import pathlib
+import stat
 import subprocess
-from grp import getgrnam
+import time
+from grp import getgrnam, struct_group
 from pathlib import Path
-from pwd import getpwnam
+from pwd import getpwnam, struct_passwd
 from textwrap import dedent
 
 from charmlibs import apt, pathops, systemd
@@ -26,6 +31,8 @@ DEST_INSTALL = pathlib.Path("/opt/ddeb-retriever")
 DEST_ARCHIVE = pathlib.Path("/srv/ddebs")
 DEST_CONF = pathlib.Path("/etc/ddeb-retriever")
 LPSIGN_CONF = DEST_CONF / "lp-sign.conf"
+STATE_DIR = pathlib.Path("/var/lib/ddeb-retriever")
+TIMER_ENABLED_STAMP = STATE_DIR / ".timer-enabled"
 SYSTEMD_UNIT = "ddeb-retriever"
 USER_DDEB = "ddeb"
 USER_WWW = "www-data"
@@ -36,6 +43,89 @@ RUN_COMMAND = (
     "--lpsign-config",
     str(LPSIGN_CONF),
 )
+TIMER_UNIT_TEMPLATE = dedent("""\
+    # Managed by ddeb charm.
+    [Unit]
+    Description=Trigger ddeb-retriever
+    [Timer]
+    OnCalendar={schedule}
+    [Install]
+    WantedBy=timers.target
+    """)
+SERVICE_UNIT_TEMPLATE = dedent(f"""\
+    # Managed by ddeb charm.
+    [Unit]
+    Description=Trigger ddeb-retriever
+    [Service]
+    # Already runs on a schedule, no need to hammer Launchpad on error.
+    Restart=no
+    User={USER_DDEB}
+    ExecStart={" ".join(RUN_COMMAND)}
+    Environment=HTTP_PROXY={{http_proxy}}
+    Environment=HTTPS_PROXY={{https_proxy}}
+    Environment=NO_PROXY={{no_proxy}}
+    """)
+HTTPD_CONF = dedent("""\
+    # Managed by ddeb charm.
+    Alias / /srv/ddebs/
+    <Directory />
+      Options Indexes MultiViews FollowSymLinks
+      Require all granted
+    </Directory>
+    """)
+APT_LISTS = pathlib.Path("/var/lib/apt/lists")
+# Package lists younger than this (in seconds) are not refreshed before installing.
+APT_LISTS_MAX_AGE = 3600
+DEPENDENCIES = ("git", "systemd", "python3-launchpadlib", "apache2", "python3-nacl")
+
+
+@functools.lru_cache(maxsize=None)
+def _pw(name: str) -> struct_passwd:
+    """Return the cached passwd entry of user `name`."""
+    return getpwnam(name)
+
+
+@functools.lru_cache(maxsize=None)
+def _gr(name: str) -> struct_group:
+    """Return the cached group entry of group `name`."""
+    return getgrnam(name)
+
+
+def _write_if_changed(
+    path: str | os.PathLike[str], content: str, *, mode: int, uid: int = -1, gid: int = -1
+) -> bool:
+    """Ensure a local file has `content`, `mode` and ownership. Return whether it changed.
+
+    Lighter alternative to `pathops.ensure_contents`: an up to date file costs one open, fstat and
+    read. Like it, symlinks are followed and missing parent directories are created. An `uid` or
+    `gid` of -1 leaves that part of the ownership alone.
+    """
+    data = content.encode()
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    except FileNotFoundError:
+        pass
+    else:
+        with os.fdopen(fd, "rb") as f:
+            st = os.fstat(f.fileno())
+            current = f.read(len(data) + 1)
+        if (
+            current == data
+            and stat.S_IMODE(st.st_mode) == mode
+            and uid in (-1, st.st_uid)
+            and gid in (-1, st.st_gid)
+        ):
+            return False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, mode)
+    with os.fdopen(fd, "wb") as f:
+        # The creation mode is subject to umask and ignored for existing files.
+        os.fchmod(f.fileno(), mode)
+        if uid != -1 or gid != -1:
+            os.fchown(f.fileno(), uid, gid)
+        f.write(data)
+    return True
 
 
 def do_conf(lp_sign_config: str):
@@ -63,20 +153,54 @@ def do_conf(lp_sign_config: str):
     )
 
 
-def do_deps():
-    """Install dependencies."""
-    logger.info("Installing dependencies.")
+def _missing_packages(packages: tuple[str, ...]) -> list[str]:
+    """Return the subset of `packages` which are not currently installed."""
+    result = subprocess.run(
+        ["dpkg-query", "-W", "-f", "${Package}\t${db:Status-Status}\n", *packages],
+        capture_output=True,
+        text=True,
+    )
+    # Unknown packages are reported on stderr only, so absence means missing.
+    installed = {
+        name
+        for name, _, status in (line.partition("\t") for line in result.stdout.splitlines())
+        if status == "installed"
+    }
+    return [pkg for pkg in packages if pkg not in installed]
+
+
+def _apt_lists_are_fresh() -> bool:
+    """Return whether the apt package lists were refreshed recently."""
+    try:
+        if time.time() - APT_LISTS.stat().st_mtime >= APT_LISTS_MAX_AGE:
+            return False
+    except FileNotFoundError:
+        return False
+    # Emptying the lists (as image builds do) also bumps the mtime.
+    return any(APT_LISTS.glob("*_Packages*"))
+
+
+def do_deps() -> bool:
+    """Install dependencies. Return whether they are all installed."""
+    missing = _missing_packages(DEPENDENCIES)
+    if not missing:
+        return True
+
+    logger.info("Installing dependencies: %s", ", ".join(missing))
     try:
-        apt.update()
-        apt.add_package(["git", "systemd", "python3-launchpadlib", "apache2", "python3-nacl"])
+        if not _apt_lists_are_fresh():
+            apt.update()
+        apt.add_package(missing)
     except apt.Error as e:
         logger.error("Failed to install dependencies: %s", e.message)
+        return False
+    return True
 
 
 def do_user():
     """Create ddeb user."""
     try:
-        getpwnam(USER_DDEB)
+        _pw(USER_DDEB)
         return
     except KeyError:
         pass
@@ -87,27 +211,38 @@ def do_user():
             "adduser",
             "--system",
             "--gid",
-            str(getgrnam(USER_WWW).gr_gid),
+            str(_gr(USER_WWW).gr_gid),
             "--home",
             "/var/cache/ddeb",
             USER_DDEB,
         ]
     )
+    _pw.cache_clear()
 
 
 def do_dirs():
     """Create and manage archive dir."""
-    if not DEST_ARCHIVE.exists():
+    # Work on a directory fd so the path is only resolved once.
+    # O_PATH would be lighter but fchown/fchmod reject such fds.
+    flags = os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC
+    try:
+        fd = os.open(DEST_ARCHIVE, flags)
+    except FileNotFoundError:
         logger.info("Creating %s", DEST_ARCHIVE)
         DEST_ARCHIVE.mkdir()
-    if DEST_ARCHIVE.owner() != USER_DDEB or DEST_ARCHIVE.group() != USER_WWW:
-        logger.info("Setting owner of %s", DEST_ARCHIVE)
-        ddeb_user = getpwnam(USER_DDEB)
-        www_group = getgrnam(USER_WWW)
-        os.chown(DEST_ARCHIVE, ddeb_user.pw_uid, www_group.gr_gid)
-    if DEST_ARCHIVE.stat().st_mode & 0o777 != 0o755:
-        logger.info("Setting perms of %s", DEST_ARCHIVE)
-        DEST_ARCHIVE.chmod(0o755)
+        fd = os.open(DEST_ARCHIVE, flags)
+    try:
+        st = os.fstat(fd)
+        ddeb_user = _pw(USER_DDEB)
+        www_group = _gr(USER_WWW)
+        if st.st_uid != ddeb_user.pw_uid or st.st_gid != www_group.gr_gid:
+            logger.info("Setting owner of %s", DEST_ARCHIVE)
+            os.fchown(fd, ddeb_user.pw_uid, www_group.gr_gid)
+        if st.st_mode & 0o777 != 0o755:
+            logger.info("Setting perms of %s", DEST_ARCHIVE)
+            os.fchmod(fd, 0o755)
+    finally:
+        os.close(fd)
 
 
 def do_git(*, remote: str, ref: str):
@@ -119,40 +254,26 @@ def do_systemd(schedule: str):
     """Set or update application timers."""
     timer_path = Path(f"/etc/systemd/system/{SYSTEMD_UNIT}.timer")
     first_install = not timer_path.exists()
-    changed = pathops.ensure_contents(
-        path=f"/etc/systemd/system/{SYSTEMD_UNIT}.timer",
-        source=dedent(f"""\
-        # Managed by ddeb charm.
-        [Unit]
-        Description=Trigger ddeb-retriever
-        [Timer]
-        OnCalendar={schedule}
-        [Install]
-        WantedBy=timers.target
-        """),
+    changed = _write_if_changed(
+        timer_path,
+        TIMER_UNIT_TEMPLATE.format(schedule=schedule),
         mode=0o444,
     )
-    changed |= pathops.ensure_contents(
-        path="/etc/systemd/system/ddeb-retriever.service",
-        source=dedent(f"""\
-        # Managed by ddeb charm.
-        [Unit]
-        Description=Trigger ddeb-retriever
-        [Service]
-        # Already runs on a schedule, no need to hammer Launchpad on error.
-        Restart=no
-        User={USER_DDEB}
-        ExecStart={" ".join(RUN_COMMAND)}
-        Environment=HTTP_PROXY={os.environ["HTTP_PROXY"]}
-        Environment=HTTPS_PROXY={os.environ["HTTPS_PROXY"]}
-        Environment=NO_PROXY={os.environ["NO_PROXY"]}
-        """),
+    changed |= _write_if_changed(
+        f"/etc/systemd/system/{SYSTEMD_UNIT}.service",
+        SERVICE_UNIT_TEMPLATE.format(
+            http_proxy=os.environ["HTTP_PROXY"],
+            https_proxy=os.environ["HTTPS_PROXY"],
+            no_proxy=os.environ["NO_PROXY"],
+        ),
         mode=0o444,
     )
-    systemd.daemon_reload()
+    if changed:
+        systemd.daemon_reload()
     # Ensure consistent pause state of units.
     if first_install or not service_is_paused():
-        service_resume()
+        if changed or not TIMER_ENABLED_STAMP.exists():
+            service_resume()
     else:
         service_pause()
 
@@ -160,24 +281,28 @@ def do_systemd(schedule: str):
 def do_httpd():
     """Set httpd service."""
     a2conf = pathlib.Path("/etc/apache2/conf-available/ddebs.conf")
-    conf_text = dedent("""\
-        # Managed by ddeb charm.
-        Alias / /srv/ddebs/
-        <Directory />
-          Options Indexes MultiViews FollowSymLinks
-          Require all granted
-        </Directory>
-        """)
-
-    needs_reload = pathops.ensure_contents(
-        path=a2conf,
-        source=conf_text,
-        user="www-data",
-        group="www-data",
+    needs_reload = _write_if_changed(
+        a2conf,
+        HTTPD_CONF,
         mode=0o644,
+        uid=_pw(USER_WWW).pw_uid,
+        gid=_gr(USER_WWW).gr_gid,
     )
-    if not os.path.exists("/etc/apache2/conf-enabled/ddebs.conf"):
-        subprocess.check_call(["a2enconf", "ddebs"])
+    # Same link a2enconf would create, without spawning the perl script.
+    enabled = "/etc/apache2/conf-enabled/ddebs.conf"
+    try:
+        needs_enable = not os.readlink(enabled).endswith("conf-available/ddebs.conf")
+    except FileNotFoundError:
+        needs_enable = True
+    except OSError as e:
+        if e.errno != errno.EINVAL:
+            raise
+        # Not a symlink, leave a locally provided conf alone.
+        needs_enable = False
+    if needs_enable:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(enabled)
+        os.symlink("../conf-available/ddebs.conf", enabled)
         needs_reload = True
     if needs_reload:
         logger.info("Reloading apache.")
@@ -192,20 +317,22 @@ def run_retriever():
 def update_git(git_ref: str):
     """Update the ddeb_retriever source tree from a git ref."""
     logger.info("Updating git branch.")
-    git.git("fetch", "origin", git_dir=DEST_INSTALL)
-    git.git("checkout", f"origin/{git_ref}", git_dir=DEST_INSTALL)
+    git.git_batch(("fetch", "origin"), ("checkout", f"origin/{git_ref}"), git_dir=DEST_INSTALL)
 
 
 def service_pause():
     """Stop the service and schedule."""
     systemd.service_pause(f"{SYSTEMD_UNIT}.timer")
     systemd.service_stop(f"{SYSTEMD_UNIT}.service")
+    TIMER_ENABLED_STAMP.unlink(missing_ok=True)
 
 
 def service_resume():
     """Restart the importer schedule."""
     systemd.service_enable(f"{SYSTEMD_UNIT}.service")
     systemd.service_resume(f"{SYSTEMD_UNIT}.timer")
+    TIMER_ENABLED_STAMP.parent.mkdir(parents=True, exist_ok=True)
+    TIMER_ENABLED_STAMP.touch()
 
 
 def service_is_paused() -> bool:
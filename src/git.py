@@ -1,53 +1,101 @@
 """Git repo management utilities."""
 
+import hashlib
 import logging
+import shlex
 import subprocess
 import sys
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Records the remote/ref last synced by `ensure_clone`, inside the clone's git dir.
+SYNC_STATE_FILE = "ddeb-charm-sync"
+
+
+def _git_argv(args: tuple[str, ...], git_dir: Path | None) -> tuple[str, ...]:
+    """Build the git command line for `args`, run against `git_dir` unless cloning."""
+    if args and args[0] == "clone":
+        return ("git", *args)
+    return ("git", "-C", str(git_dir), *args)
+
 
 def git(*args: str, git_dir: Path | None) -> str:
     """Run a git command against app and return output."""
-    if args and args[0] == "clone":
-        args = ("git", *args)
-    else:
-        args = ("git", "-C", str(git_dir), *args)
     return subprocess.check_output(
-        args,
+        _git_argv(args, git_dir),
         encoding=sys.getfilesystemencoding(),
     )
 
 
-def get_current_ref(git_dir: Path):
-    """Return the current ref for a `git_dir`."""
+def git_bytes(*args: str, git_dir: Path | None) -> bytes:
+    """Run a git command against app and return undecoded output."""
+    return subprocess.check_output(_git_argv(args, git_dir))
+
+
+def git_batch(*commands: tuple[str, ...], git_dir: Path) -> str:
+    """Run a sequence of git commands against app in one shell, stopping at the first failure."""
+    script = " && ".join(shlex.join(("git", "-C", str(git_dir), *cmd)) for cmd in commands)
+    return subprocess.check_output(
+        ("sh", "-c", script),
+        encoding=sys.getfilesystemencoding(),
+    )
+
+
+def is_at_ref(git_dir: Path, ref: str) -> bool:
+    """Return whether HEAD of `git_dir` is at the tip of `origin/<ref>`."""
+    # A single rev-parse resolves both names without walking all refs like describe does.
     try:
-        ref = git("describe", "--all", "--exact-match", "--always", "HEAD", git_dir=git_dir)
-        return ref.removeprefix("remote/origin/").removeprefix("heads/").strip()
-    except subprocess.CalledProcessError:
-        try:
-            return git("rev-parse", "HEAD", git_dir=git_dir).strip()
-        except subprocess.CalledProcessError:
-            return None
+        head, tip = git_bytes("rev-parse", "HEAD", f"origin/{ref}", git_dir=git_dir).split()
+    except (subprocess.CalledProcessError, ValueError):
+        return False
+    return head == tip
 
 
-def ensure_clone(dest: Path, remote: str, ref: str):
-    """Ensure the state of a clone exists and matches remote/ref spec."""
-    if not dest.exists():
-        logger.info("Deploying app from git.")
-        git("clone", remote, str(dest), git_dir=None)
+def _sync_state(remote: str, ref: str) -> str:
+    """Return a digest identifying a remote/ref spec."""
+    return hashlib.sha1(f"{remote}\0{ref}".encode(), usedforsecurity=False).hexdigest()
 
+
+def _update_clone(dest: Path, remote: str, ref: str):
+    """Bring an existing clone in line with the remote/ref spec."""
     current_remote = git("remote", "get-url", "origin", git_dir=dest).strip()
+    commands: list[tuple[str, ...]] = []
     if remote != current_remote:
         logger.info("Current remote: %s", current_remote)
         logger.info("Updating origin.")
-        git("remote", "set-url", "origin", remote, git_dir=dest)
+        # HEAD can't be compared against the old remote, so always check out the new ref.
+        commands = [
+            ("remote", "set-url", "origin", remote),
+            ("fetch", "origin"),
+            ("checkout", f"origin/{ref}"),
+        ]
+    elif not is_at_ref(git_dir=dest, ref=ref):
+        logger.info("HEAD is not at origin/%s.", ref)
         logger.info("Updating git branch.")
-        git("fetch", "origin", git_dir=dest)
+        commands = [("checkout", f"origin/{ref}")]
+    if commands:
+        git_batch(*commands, git_dir=dest)
 
-    current_ref = get_current_ref(git_dir=dest)
-    if ref != current_ref:
-        logger.info("Current git ref: %s", get_current_ref)
-        logger.info("Updating git branch.")
-        git("checkout", f"origin/{ref}", git_dir=dest)
+
+def ensure_clone(dest: Path, remote: str, ref: str):
+    """Ensure the state of a clone exists and matches remote/ref spec."""
+    state = _sync_state(remote, ref)
+    state_file = dest / ".git" / SYNC_STATE_FILE
+    try:
+        if state_file.read_text() == state:
+            return
+    except FileNotFoundError:
+        pass
+
+    if not dest.exists():
+        logger.info("Deploying app from git.")
+        # A fresh clone of the configured branch needs no remote or ref probing.
+        git("clone", "--branch", ref, remote, str(dest), git_dir=None)
+    else:
+        _update_clone(dest, remote=remote, ref=ref)
+
+    try:
+        state_file.write_text(state)
+    except OSError as e:
+        logger.warning("Could not record git sync state: %s", e)
@@ -0,0 +1,108 @@
+# Copyright 2025 Canonical
+# See LICENSE file for licensing details.
+import dataclasses
+import os
+from unittest import mock
+
+from ops import testing
+
+import charm
+import ddeb_retriever
+
+
+def test_wb_proxy_config():
+    """Whitebox testing for proxy config."""
+    os.environ["JUJU_CHARM_HTTP_PROXY"] = "http://theproxy"
+    charm._init_proxies()
+    conf_valid = []
+
+    class MockDdeb(charm.DdebCharm):
+        on = mock.MagicMock()
+
+        def validate_config(self, cfg):
+            assert os.environ["HTTP_PROXY"] == "http://theproxy"
+            conf_valid.append(True)
+
+    # force early return
+    ddeb = MockDdeb(mock.MagicMock())
+    charm.DdebCharm.apply(ddeb)
+    assert conf_valid
+
+
+def _configured_state():
+    secret = testing.Secret(tracked_content={"config": "lpconf"})
+    config = {
+        "lp-sign-config": secret.id,
+        "schedule": "daily",
+        "git-ref": "main",
+        "git-repository": "https://repo",
+    }
+    return testing.State(config=config, secrets={secret})
+
+
+def test_apply_skips_when_state_already_applied():
+    ctx = testing.Context(charm.DdebCharm)
+    with mock.patch("charm.ddeb_retriever") as mock_retriever:
+        mock_retriever.service_is_paused.return_value = False
+        state = ctx.run(ctx.on.config_changed(), _configured_state())
+        ctx.run(ctx.on.start(), state)
+
+    mock_retriever.do_deps.assert_called_once_with()
+
+
+def test_apply_runs_again_after_failed_deps():
+    ctx = testing.Context(charm.DdebCharm)
+    with (
+        mock.patch("ddeb_retriever._missing_packages", return_value=["python3-nacl"]),
+        mock.patch("ddeb_retriever._apt_lists_are_fresh", return_value=True),
+        mock.patch("ddeb_retriever.apt.add_package") as mock_add_package,
+        mock.patch.multiple(
+            "ddeb_retriever",
+            do_git=mock.DEFAULT,
+            do_user=mock.DEFAULT,
+            do_conf=mock.DEFAULT,
+            do_dirs=mock.DEFAULT,
+            do_systemd=mock.DEFAULT,
+            do_httpd=mock.DEFAULT,
+            service_is_paused=mock.Mock(return_value=False),
+        ),
+    ):
+        mock_add_package.side_effect = [ddeb_retriever.apt.Error("no network"), None]
+        state = ctx.run(ctx.on.install(), _configured_state())
+        state = ctx.run(ctx.on.config_changed(), state)
+        ctx.run(ctx.on.start(), state)
+
+    assert mock_add_package.call_count == 2
+
+
+def test_apply_runs_again_after_upgrade():
+    ctx = testing.Context(charm.DdebCharm)
+    with mock.patch("charm.ddeb_retriever") as mock_retriever:
+        mock_retriever.service_is_paused.return_value = False
+        state = ctx.run(ctx.on.config_changed(), _configured_state())
+        ctx.run(ctx.on.upgrade_charm(), state)
+
+    assert mock_retriever.do_deps.call_count == 2
+
+
+def test_apply_clears_blocked_status_when_config_is_restored():
+    good = _configured_state()
+    bad_secret = testing.Secret(tracked_content={"other": "value"})
+    good_config = dict(good.config)
+    ctx = testing.Context(charm.DdebCharm)
+    with mock.patch("charm.ddeb_retriever") as mock_retriever:
+        mock_retriever.service_is_paused.return_value = False
+        state = ctx.run(ctx.on.config_changed(), good)
+        state = ctx.run(
+            ctx.on.config_changed(),
+            dataclasses.replace(
+                state,
+                config={**good_config, "lp-sign-config": bad_secret.id},
+                secrets={*state.secrets, bad_secret},
+            ),
+        )
+        assert isinstance(state.unit_status, testing.BlockedStatus)
+        state = ctx.run(ctx.on.config_changed(), dataclasses.replace(state, config=good_config))
+
+    assert state.unit_status == testing.ActiveStatus()
+    assert mock_retriever.do_deps.call_count == 2
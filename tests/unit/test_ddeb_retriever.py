@@ -1,9 +1,12 @@
 # Copyright 2025 Canonical
 # See LICENSE file for licensing details.
+import errno
 import os
+from pathlib import Path
 from unittest import mock
 
-import charm
+import pytest
+
 import ddeb_retriever
 
 
@@ -16,8 +19,11 @@ def test_run_retriever_invokes_sudo_as_ddeb_user():
     )
 
 
-def test_service_pause_stops_timer_and_service():
+def test_service_pause_stops_timer_and_service(tmp_path):
+    stamp = tmp_path / ".timer-enabled"
+    stamp.touch()
     with (
+        mock.patch("ddeb_retriever.TIMER_ENABLED_STAMP", stamp),
         mock.patch("ddeb_retriever.systemd.service_pause") as mock_pause,
         mock.patch("ddeb_retriever.systemd.service_stop") as mock_stop,
     ):
@@ -25,10 +31,13 @@ def test_service_pause_stops_timer_and_service():
 
     mock_pause.assert_called_once_with("ddeb-retriever.timer")
     mock_stop.assert_called_once_with("ddeb-retriever.service")
+    assert not stamp.exists()
 
 
-def test_service_resume_enables_service_and_resumes_timer():
+def test_service_resume_enables_service_and_resumes_timer(tmp_path):
+    stamp = tmp_path / "state" / ".timer-enabled"
     with (
+        mock.patch("ddeb_retriever.TIMER_ENABLED_STAMP", stamp),
         mock.patch("ddeb_retriever.systemd.service_enable") as mock_enable,
         mock.patch("ddeb_retriever.systemd.service_resume") as mock_resume,
     ):
@@ -36,6 +45,7 @@ def test_service_resume_enables_service_and_resumes_timer():
 
     mock_enable.assert_called_once_with("ddeb-retriever.service")
     mock_resume.assert_called_once_with("ddeb-retriever.timer")
+    assert stamp.exists()
 
 
 def test_service_is_paused_true_when_timer_not_running():
@@ -48,19 +58,306 @@ def test_service_is_paused_false_when_timer_running():
         assert ddeb_retriever.service_is_paused() is False
 
 
-def test_wb_proxy_config():
-    """Whitebox testing for proxy config."""
-    os.environ["JUJU_CHARM_HTTP_PROXY"] = "http://theproxy"
-    conf_valid = []
+def test_do_deps_skips_apt_when_installed():
+    stdout = "".join(f"{pkg}\tinstalled\n" for pkg in ddeb_retriever.DEPENDENCIES)
+    with (
+        mock.patch("subprocess.run") as mock_run,
+        mock.patch("ddeb_retriever.apt") as mock_apt,
+    ):
+        mock_run.return_value.stdout = stdout
+        ddeb_retriever.do_deps()
+
+    mock_apt.update.assert_not_called()
+    mock_apt.add_package.assert_not_called()
+
+
+def test_do_deps_installs_only_missing_packages(tmp_path):
+    lists = tmp_path / "lists"
+    with (
+        mock.patch("ddeb_retriever.APT_LISTS", lists),
+        mock.patch("subprocess.run") as mock_run,
+        mock.patch("ddeb_retriever.apt") as mock_apt,
+    ):
+        mock_run.return_value.stdout = (
+            "git\tinstalled\nsystemd\tinstalled\napache2\tnot-installed\npython3-nacl\tinstalled\n"
+        )
+        ddeb_retriever.do_deps()
+
+    mock_apt.update.assert_called_once_with()
+    mock_apt.add_package.assert_called_once_with(["python3-launchpadlib", "apache2"])
+
+
+def test_do_deps_skips_update_when_lists_are_fresh(tmp_path):
+    (tmp_path / "archive.ubuntu.com_ubuntu_dists_noble_main_binary-amd64_Packages").touch()
+    with (
+        mock.patch("ddeb_retriever.APT_LISTS", tmp_path),
+        mock.patch("subprocess.run") as mock_run,
+        mock.patch("ddeb_retriever.apt") as mock_apt,
+    ):
+        mock_run.return_value.stdout = ""
+        ddeb_retriever.do_deps()
+
+    mock_apt.update.assert_not_called()
+    mock_apt.add_package.assert_called_once_with(list(ddeb_retriever.DEPENDENCIES))
+
+
+def test_do_deps_updates_when_recent_lists_are_empty(tmp_path):
+    (tmp_path / "lock").touch()
+    with (
+        mock.patch("ddeb_retriever.APT_LISTS", tmp_path),
+        mock.patch("subprocess.run") as mock_run,
+        mock.patch("ddeb_retriever.apt") as mock_apt,
+    ):
+        mock_run.return_value.stdout = ""
+        ddeb_retriever.do_deps()
+
+    mock_apt.update.assert_called_once_with()
+
+
+def test_do_dirs_noop_when_archive_matches(tmp_path):
+    archive = tmp_path / "ddebs"
+    archive.mkdir(mode=0o755)
+    archive.chmod(0o755)
+    st = archive.stat()
+    with (
+        mock.patch("ddeb_retriever.DEST_ARCHIVE", archive),
+        mock.patch("ddeb_retriever._pw") as mock_pw,
+        mock.patch("ddeb_retriever._gr") as mock_gr,
+        mock.patch("os.fchown") as mock_fchown,
+    ):
+        mock_pw.return_value.pw_uid = st.st_uid
+        mock_gr.return_value.gr_gid = st.st_gid
+        ddeb_retriever.do_dirs()
+
+    mock_fchown.assert_not_called()
+
+
+def test_do_dirs_creates_and_fixes_archive(tmp_path):
+    archive = tmp_path / "ddebs"
+    with (
+        mock.patch("ddeb_retriever.DEST_ARCHIVE", archive),
+        mock.patch("ddeb_retriever._pw") as mock_pw,
+        mock.patch("ddeb_retriever._gr") as mock_gr,
+        mock.patch("os.fchown") as mock_fchown,
+    ):
+        mock_pw.return_value.pw_uid = 12345
+        mock_gr.return_value.gr_gid = 54321
+        ddeb_retriever.do_dirs()
+
+    assert archive.is_dir()
+    assert archive.stat().st_mode & 0o777 == 0o755
+    mock_fchown.assert_called_once_with(mock.ANY, 12345, 54321)
+
+
+def test_do_user_refreshes_cached_entry_after_creation():
+    ddeb_retriever._pw.cache_clear()
+    with (
+        mock.patch("ddeb_retriever.getpwnam", side_effect=[KeyError("ddeb"), "created"]),
+        mock.patch("ddeb_retriever._gr") as mock_gr,
+        mock.patch("subprocess.check_call") as mock_check_call,
+    ):
+        mock_gr.return_value.gr_gid = 33
+        ddeb_retriever.do_user()
+        assert ddeb_retriever._pw("ddeb") == "created"
+    ddeb_retriever._pw.cache_clear()
+
+    mock_check_call.assert_called_once_with(
+        ["adduser", "--system", "--gid", "33", "--home", "/var/cache/ddeb", "ddeb"]
+    )
+
+
+def test_do_systemd_skips_daemon_reload_when_units_unchanged():
+    with (
+        mock.patch.object(Path, "exists", return_value=True),
+        mock.patch.dict(os.environ, {"HTTP_PROXY": "", "HTTPS_PROXY": "", "NO_PROXY": ""}),
+        mock.patch("ddeb_retriever._write_if_changed", return_value=False),
+        mock.patch("ddeb_retriever.systemd") as mock_systemd,
+    ):
+        mock_systemd.service_running.return_value = True
+        ddeb_retriever.do_systemd("daily")
+
+    mock_systemd.daemon_reload.assert_not_called()
+    mock_systemd.service_enable.assert_not_called()
+    mock_systemd.service_resume.assert_not_called()
+
+
+def test_do_systemd_resumes_timer_when_stamp_is_missing(tmp_path):
+    stamp = tmp_path / ".timer-enabled"
+    with (
+        mock.patch("ddeb_retriever.TIMER_ENABLED_STAMP", stamp),
+        mock.patch.dict(os.environ, {"HTTP_PROXY": "", "HTTPS_PROXY": "", "NO_PROXY": ""}),
+        mock.patch("ddeb_retriever._write_if_changed", return_value=False),
+        mock.patch("ddeb_retriever.systemd") as mock_systemd,
+    ):
+        mock_systemd.service_running.return_value = True
+        ddeb_retriever.do_systemd("daily")
+
+    mock_systemd.service_enable.assert_called_once_with("ddeb-retriever.service")
+    mock_systemd.service_resume.assert_called_once_with("ddeb-retriever.timer")
+    assert stamp.exists()
+
+
+def test_do_systemd_renders_units(tmp_path):
+    with (
+        mock.patch("ddeb_retriever.TIMER_ENABLED_STAMP", tmp_path / ".timer-enabled"),
+        mock.patch.object(Path, "exists", return_value=False),
+        mock.patch.dict(
+            os.environ,
+            {"HTTP_PROXY": "http://proxy", "HTTPS_PROXY": "http://sproxy", "NO_PROXY": "local"},
+        ),
+        mock.patch("ddeb_retriever._write_if_changed", return_value=True) as mock_write,
+        mock.patch("ddeb_retriever.systemd") as mock_systemd,
+    ):
+        ddeb_retriever.do_systemd("daily")
+
+    timer, service = (c.args[1] for c in mock_write.call_args_list)
+    assert "OnCalendar=daily\n" in timer
+    assert "User=ddeb\n" in service
+    assert "Environment=HTTPS_PROXY=http://sproxy\n" in service
+    mock_systemd.daemon_reload.assert_called_once_with()
+    mock_systemd.service_resume.assert_called_once_with("ddeb-retriever.timer")
+
+
+def test_write_if_changed_creates_file(tmp_path):
+    path = tmp_path / "unit"
+    assert ddeb_retriever._write_if_changed(path, "content\n", mode=0o444)
+
+    assert path.read_text() == "content\n"
+    assert path.stat().st_mode & 0o777 == 0o444
+
+
+def test_write_if_changed_noop_when_up_to_date(tmp_path):
+    path = tmp_path / "unit"
+    path.write_text("content\n")
+    path.chmod(0o644)
+    with mock.patch("os.fchown") as mock_fchown:
+        assert not ddeb_retriever._write_if_changed(
+            path, "content\n", mode=0o644, uid=path.stat().st_uid
+        )
+
+    mock_fchown.assert_not_called()
+
+
+def test_write_if_changed_rewrites_content_and_mode(tmp_path):
+    path = tmp_path / "unit"
+    path.write_text("content\nand a longer stale tail\n")
+    path.chmod(0o600)
+    assert ddeb_retriever._write_if_changed(path, "content\n", mode=0o644)
+
+    assert path.read_text() == "content\n"
+    assert path.stat().st_mode & 0o777 == 0o644
+
+
+def test_do_httpd_enables_conf_and_reloads():
+    with (
+        mock.patch("ddeb_retriever._write_if_changed", return_value=False),
+        mock.patch("ddeb_retriever._pw"),
+        mock.patch("ddeb_retriever._gr"),
+        mock.patch("os.readlink", side_effect=FileNotFoundError),
+        mock.patch("os.unlink"),
+        mock.patch("os.symlink") as mock_symlink,
+        mock.patch("ddeb_retriever.systemd") as mock_systemd,
+    ):
+        ddeb_retriever.do_httpd()
+
+    mock_symlink.assert_called_once_with(
+        "../conf-available/ddebs.conf", "/etc/apache2/conf-enabled/ddebs.conf"
+    )
+    mock_systemd.service_reload.assert_called_once_with("apache2.service")
+
+
+def test_do_httpd_noop_when_enabled():
+    with (
+        mock.patch("ddeb_retriever._write_if_changed", return_value=False),
+        mock.patch("ddeb_retriever._pw"),
+        mock.patch("ddeb_retriever._gr"),
+        mock.patch("os.readlink", return_value="../conf-available/ddebs.conf"),
+        mock.patch("os.symlink") as mock_symlink,
+        mock.patch("ddeb_retriever.systemd") as mock_systemd,
+    ):
+        ddeb_retriever.do_httpd()
+
+    mock_symlink.assert_not_called()
+    mock_systemd.service_reload.assert_not_called()
 
-    class MockDdeb(charm.DdebCharm):
-        on = mock.MagicMock()
 
-        def config_is_valid(self):
-            assert os.environ["HTTP_PROXY"] == "http://theproxy"
-            conf_valid.append(True)
+def test_do_httpd_replaces_stale_link():
+    with (
+        mock.patch("ddeb_retriever._write_if_changed", return_value=False),
+        mock.patch("ddeb_retriever._pw"),
+        mock.patch("ddeb_retriever._gr"),
+        mock.patch("os.readlink", return_value="../conf-available/other.conf"),
+        mock.patch("os.unlink") as mock_unlink,
+        mock.patch("os.symlink") as mock_symlink,
+        mock.patch("ddeb_retriever.systemd") as mock_systemd,
+    ):
+        ddeb_retriever.do_httpd()
+
+    mock_unlink.assert_called_once_with("/etc/apache2/conf-enabled/ddebs.conf")
+    mock_symlink.assert_called_once()
+    mock_systemd.service_reload.assert_called_once_with("apache2.service")
+
+
+def test_do_dirs_fixes_perms(tmp_path):
+    archive = tmp_path / "ddebs"
+    archive.mkdir()
+    archive.chmod(0o700)
+    st = archive.stat()
+    with (
+        mock.patch("ddeb_retriever.DEST_ARCHIVE", archive),
+        mock.patch("ddeb_retriever._pw") as mock_pw,
+        mock.patch("ddeb_retriever._gr") as mock_gr,
+    ):
+        mock_pw.return_value.pw_uid = st.st_uid
+        mock_gr.return_value.gr_gid = st.st_gid
+        ddeb_retriever.do_dirs()
+
+    assert archive.stat().st_mode & 0o777 == 0o755
+
+
+def test_write_if_changed_creates_parent_dirs(tmp_path):
+    path = tmp_path / "conf-available" / "ddebs.conf"
+    assert ddeb_retriever._write_if_changed(path, "content\n", mode=0o644)
+
+    assert path.read_text() == "content\n"
+
+
+def test_write_if_changed_follows_symlinks(tmp_path):
+    target = tmp_path / "target"
+    target.write_text("old\n")
+    link = tmp_path / "link"
+    link.symlink_to(target)
+    assert ddeb_retriever._write_if_changed(link, "content\n", mode=0o644)
+    assert not ddeb_retriever._write_if_changed(link, "content\n", mode=0o644)
+
+    assert link.is_symlink()
+    assert target.read_text() == "content\n"
+
+
+def test_do_httpd_keeps_local_conf_file():
+    with (
+        mock.patch("ddeb_retriever._write_if_changed", return_value=False),
+        mock.patch("ddeb_retriever._pw"),
+        mock.patch("ddeb_retriever._gr"),
+        mock.patch("os.readlink", side_effect=OSError(errno.EINVAL, "Invalid argument")),
+        mock.patch("os.symlink") as mock_symlink,
+        mock.patch("ddeb_retriever.systemd") as mock_systemd,
+    ):
+        ddeb_retriever.do_httpd()
+
+    mock_symlink.assert_not_called()
+    mock_systemd.service_reload.assert_not_called()
+
+
+def test_do_httpd_raises_on_unexpected_readlink_error():
+    with (
+        mock.patch("ddeb_retriever._write_if_changed", return_value=False),
+        mock.patch("ddeb_retriever._pw"),
+        mock.patch("ddeb_retriever._gr"),
+        mock.patch("os.readlink", side_effect=PermissionError(errno.EACCES, "Denied")),
+        mock.patch("os.symlink") as mock_symlink,
+        pytest.raises(PermissionError),
+    ):
+        ddeb_retriever.do_httpd()
 
-    # force early return
-    ddeb = MockDdeb(mock.MagicMock())
-    charm.DdebCharm.apply(ddeb)
-    assert conf_valid
+    mock_symlink.assert_not_called()
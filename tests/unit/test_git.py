@@ -24,22 +24,38 @@ def test_git_passes_context(mock_popen):
     mock_popen.assert_called_once_with(("git", "-C", "/opt/dest", "branch"), encoding=mock.ANY)
 
 
+@mock.patch("subprocess.check_output")
+def test_git_bytes_skips_decoding(mock_popen):
+    git.git_bytes("rev-parse", "HEAD", git_dir=Path("/opt/dest"))
+    mock_popen.assert_called_once_with(("git", "-C", "/opt/dest", "rev-parse", "HEAD"))
+
+
+@mock.patch("subprocess.check_output")
+def test_git_batch_runs_commands_in_one_shell(mock_popen):
+    git.git_batch(("fetch", "origin"), ("checkout", "origin/my branch"), git_dir=Path("/opt/dest"))
+    mock_popen.assert_called_once_with(
+        (
+            "sh",
+            "-c",
+            "git -C /opt/dest fetch origin && git -C /opt/dest checkout 'origin/my branch'",
+        ),
+        encoding=mock.ANY,
+    )
+
+
 def test_ensure_clone_clones_when_dest_is_missing():
     with (
         tempfile.TemporaryDirectory() as tmp_dir,
         mock.patch("git.git") as mock_git,
-        mock.patch("git.get_current_ref", return_value="main"),
+        mock.patch("git.is_at_ref", return_value=True),
     ):
         dest = Path(tmp_dir)
         dest.rmdir()
         mock_git.return_value = "https://repo\n"
         git.ensure_clone(dest=dest, remote="https://repo", ref="main")
 
-    mock_git.assert_has_calls(
-        [
-            mock.call("clone", "https://repo", str(dest), git_dir=None),
-            mock.call("remote", "get-url", "origin", git_dir=dest),
-        ]
+    mock_git.assert_called_once_with(
+        "clone", "--branch", "main", "https://repo", str(dest), git_dir=None
     )
 
 
@@ -48,16 +64,17 @@ def test_ensure_clone_updates_remote_when_it_differs():
     with (
         mock.patch.object(Path, "exists", return_value=True),
         mock.patch("git.git") as mock_git,
-        mock.patch("git.get_current_ref", return_value="main"),
+        mock.patch("git.git_batch") as mock_batch,
+        mock.patch("git.is_at_ref", return_value=True),
     ):
         mock_git.return_value = "https://old-repo\n"
         git.ensure_clone(dest=dest, remote="https://repo", ref="main")
 
-    mock_git.assert_has_calls(
-        [
-            mock.call("remote", "set-url", "origin", "https://repo", git_dir=dest),
-            mock.call("fetch", "origin", git_dir=dest),
-        ]
+    mock_batch.assert_called_once_with(
+        ("remote", "set-url", "origin", "https://repo"),
+        ("fetch", "origin"),
+        ("checkout", "origin/main"),
+        git_dir=dest,
     )
 
 
@@ -66,16 +83,13 @@ def test_ensure_clone_checks_out_ref_when_it_differs():
     with (
         mock.patch.object(Path, "exists", return_value=True),
         mock.patch("git.git") as mock_git,
-        mock.patch("git.get_current_ref", return_value="old-ref"),
+        mock.patch("git.git_batch") as mock_batch,
+        mock.patch("git.is_at_ref", return_value=False),
     ):
         mock_git.return_value = "https://repo\n"
         git.ensure_clone(dest=dest, remote="https://repo", ref="main")
 
-    mock_git.assert_has_calls(
-        [
-            mock.call("checkout", "origin/main", git_dir=dest),
-        ]
-    )
+    mock_batch.assert_called_once_with(("checkout", "origin/main"), git_dir=dest)
 
 
 def test_ensure_clone_checks_out_ref_when_broken():
@@ -83,20 +97,14 @@ def test_ensure_clone_checks_out_ref_when_broken():
     with (
         mock.patch.object(Path, "exists", return_value=True),
         mock.patch("git.git") as mock_git,
+        mock.patch("git.git_bytes") as mock_git_bytes,
+        mock.patch("git.git_batch") as mock_batch,
     ):
-        mock_git.side_effect = [
-            "https://repo\n",
-            subprocess.CalledProcessError(1, "git describe"),
-            subprocess.CalledProcessError(1, "git rev-parse"),
-            "",
-        ]
+        mock_git.return_value = "https://repo\n"
+        mock_git_bytes.side_effect = subprocess.CalledProcessError(128, "git rev-parse")
         git.ensure_clone(dest=dest, remote="https://repo", ref="main")
 
-    mock_git.assert_has_calls(
-        [
-            mock.call("checkout", "origin/main", git_dir=dest),
-        ]
-    )
+    mock_batch.assert_called_once_with(("checkout", "origin/main"), git_dir=dest)
 
 
 def test_ensure_clone_noops_when_remote_and_ref_already_match():
@@ -104,7 +112,7 @@ def test_ensure_clone_noops_when_remote_and_ref_already_match():
     with (
         mock.patch.object(Path, "exists", return_value=True),
         mock.patch("git.git") as mock_git,
-        mock.patch("git.get_current_ref", return_value="main"),
+        mock.patch("git.is_at_ref", return_value=True),
     ):
         mock_git.return_value = "https://repo\n"
         git.ensure_clone(dest=dest, remote="https://repo", ref="main")
@@ -112,10 +120,51 @@ def test_ensure_clone_noops_when_remote_and_ref_already_match():
     mock_git.assert_called_once_with("remote", "get-url", "origin", git_dir=dest)
 
 
-def test_get_current_ref():
+def test_is_at_ref():
     dest = Path("/opt/dest")
+    with mock.patch("git.git_bytes") as mock_git_bytes:
+        mock_git_bytes.return_value = b"abc123\nabc123\n"
+        assert git.is_at_ref(dest, "main")
+
+    mock_git_bytes.assert_called_once_with("rev-parse", "HEAD", "origin/main", git_dir=dest)
+
+
+def test_is_at_ref_false_when_head_differs():
+    with mock.patch("git.git_bytes", return_value=b"abc123\ndef456\n"):
+        assert not git.is_at_ref(Path("/opt/dest"), "main")
+
+
+def test_ensure_clone_records_sync_state(tmp_path):
+    (tmp_path / ".git").mkdir()
+    with (
+        mock.patch("git.git") as mock_git,
+        mock.patch("git.is_at_ref", return_value=True),
+    ):
+        mock_git.return_value = "https://repo\n"
+        git.ensure_clone(dest=tmp_path, remote="https://repo", ref="main")
+
+    state = (tmp_path / ".git" / git.SYNC_STATE_FILE).read_text()
+    assert state == git._sync_state("https://repo", "main")
+
+
+def test_ensure_clone_skips_git_when_sync_state_matches(tmp_path):
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / git.SYNC_STATE_FILE).write_text(git._sync_state("https://repo", "main"))
     with mock.patch("git.git") as mock_git:
-        mock_git.return_value = "remote/origin/heads/main\n"
-        result = git.get_current_ref(dest)
+        git.ensure_clone(dest=tmp_path, remote="https://repo", ref="main")
+
+    mock_git.assert_not_called()
+
+
+def test_ensure_clone_syncs_when_sync_state_differs(tmp_path):
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / git.SYNC_STATE_FILE).write_text(git._sync_state("https://repo", "old"))
+    with (
+        mock.patch("git.git") as mock_git,
+        mock.patch("git.git_batch") as mock_batch,
+        mock.patch("git.is_at_ref", return_value=False),
+    ):
+        mock_git.return_value = "https://repo\n"
+        git.ensure_clone(dest=tmp_path, remote="https://repo", ref="main")
 
-    assert result == "main"
+    mock_batch.assert_called_once_with(("checkout", "origin/main"), git_dir=tmp_path)